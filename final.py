@@ -1,93 +1,236 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from io import BytesIO
 from PIL import Image
 from rapidfuzz import process, fuzz
-from indic_transliteration.sanscript import transliterate, DEVANAGARI, ITRANS
+from indic_transliteration.sanscript import transliterate, SchemeMap, SCHEMES, DEVANAGARI, ITRANS
+from functools import lru_cache
+from collections import defaultdict
+from joblib import Parallel, delayed
 import re
 
+# Built once; transliterate() otherwise rebuilds the scheme map on every call
+DEVANAGARI_TO_ITRANS = SchemeMap(SCHEMES[DEVANAGARI], SCHEMES[ITRANS])
+
 # Convert Nepali numbers to English
+NEPALI_TO_ENGLISH_DIGITS = str.maketrans({'०': '0', '१': '1', '२': '2', '३': '3', '४': '4',
+                                          '५': '5', '६': '6', '७': '7', '८': '8', '९': '9'})
+
 def convert_nepali_number_to_english(text):
-    mapping = {'०': '0', '१': '1', '२': '2', '३': '3', '४': '4',
-               '५': '5', '६': '6', '७': '7', '८': '8', '९': '9'}
     if not isinstance(text, str):
         return text
-    return ''.join(mapping.get(char, char) for char in text)
+    return text.translate(NEPALI_TO_ENGLISH_DIGITS)
+
+# From this many rows, string columns are converted on the codepoint buffer instead of per string.
+# The buffer is rows x longest cell wide, so columns with long cells (remarks, addresses) stay on str.translate.
+BATCH_CONVERT_MIN_ROWS = 100_000
+BATCH_CONVERT_MAX_CHARS = 64
 
 def convert_numbers(df):
-    return df.apply(lambda x: x.map(convert_nepali_number_to_english) if x.dtype == "object" else x)
+    text = df.select_dtypes(include=['object', 'string'])
+    df[text.columns] = text.apply(convert_number_column)
+    return df
+
+def convert_number_column(values):
+    # .str only works on text columns; bools, dates or mixed values go cell by cell
+    if pd.api.types.infer_dtype(values, skipna=True) != 'string':
+        return values.map(convert_nepali_number_to_english)
+    if len(values) >= BATCH_CONVERT_MIN_ROWS and values.str.len().max() <= BATCH_CONVERT_MAX_CHARS:
+        return convert_numbers_batch(values)
+    return values.str.translate(NEPALI_TO_ENGLISH_DIGITS)
+
+def convert_numbers_batch(values):
+    """Convert Devanagari digits in a string Series by shifting its UTF-32 codepoints; NA is kept"""
+    missing = values.isna()
+    arr = np.asarray(values.fillna(''), dtype=str).copy()
+    buf = arr.view(np.uint32)
+    digits = (buf >= 0x966) & (buf <= 0x96F)
+    buf[digits] -= 0x966 - ord('0')
+    return pd.Series(arr, index=values.index, dtype=values.dtype).mask(missing, values)
 
 def clean_column(df, column):
-    df[column] = df[column].astype(str).str.strip()
-    df[column] = df[column].replace(['nan', '', ' '], None)
+    values = df[column].astype('string[pyarrow]').str.strip()
+    df[column] = values.mask(values == '')
     return df
 
+def to_join_keys(left, right):
+    """Encode two cleaned citizenship columns as int64 or shared categorical keys for a faster merge"""
+    # Drop leading zeros from all-digit IDs first so "0678" matches "678" whichever path is taken
+    left = left.str.replace(r'^0+(?=\d+$)', '', regex=True)
+    right = right.str.replace(r'^0+(?=\d+$)', '', regex=True)
+    if left.str.fullmatch(r'\d{1,18}').all() and right.str.fullmatch(r'\d{1,18}').all():
+        return pd.to_numeric(left).astype('Int64'), pd.to_numeric(right).astype('Int64')
+    # Non-numeric IDs like "12-34": join on integer codes of one shared category set
+    keys = pd.CategoricalDtype(pd.Index(left.dropna().unique()).union(right.dropna().unique()))
+    return left.astype(keys), right.astype(keys)
+
+@st.cache_data(show_spinner=False)
+def read_nrb_excel(data, nrows=None):
+    return pd.read_excel(BytesIO(data), nrows=nrows, dtype=str)
+
+def unique_headers(names):
+    """Name blank and repeated headers like pandas does ("Unnamed: 2", "A.1") so columns stay selectable"""
+    seen = defaultdict(int)
+    columns = []
+    for i, col in enumerate(names):
+        col = col or f'Unnamed: {i}'
+        columns.append(f'{col}.{seen[col]}' if seen[col] else col)
+        seen[col] += 1
+    return columns
+
+@st.cache_data(show_spinner=False)
+def read_adbl_csv(data, preview=False):
+    """Read the ADBL CSV with pyarrow; preview=True parses only the first block"""
+    read_options = pacsv.ReadOptions(encoding='utf8')
+    if preview:
+        reader = pacsv.open_csv(BytesIO(data), read_options=read_options)
+        batch = next(iter(reader), None)
+        table = pa.Table.from_batches([batch] if batch is not None else [], schema=reader.schema)
+    else:
+        table = pacsv.read_csv(BytesIO(data), read_options=read_options)
+    # pyarrow falls back to binary columns instead of failing on non-UTF-8 text
+    if any(pa.types.is_binary(field.type) for field in table.schema):
+        raise UnicodeDecodeError('utf-8', data, 0, len(data), 'invalid UTF-8 data in CSV')
+    df = table.rename_columns(unique_headers(table.column_names)).to_pandas(types_mapper=pd.ArrowDtype)
+    return df.head(5) if preview else df
+
 def to_excel(df):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         df.to_excel(writer, index=False)
     return output.getvalue()
 
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
 def clean_name(name):
     if not isinstance(name, str):
         return ''
-    name = name.strip().lower()
-    name = re.sub(r'[^\w\s]', '', name)  # Remove punctuation
-    return name
+    return PUNCTUATION_RE.sub('', name.strip().lower())
+
+# Common Devanagari name abbreviations, matched longest first in a single pass
+DEVANAGARI_ABBREVIATIONS = {'के.सि': 'केसी', 'कु.': 'कुमार', 'श.': 'शर्मा'}  # Add more as needed
+DEVANAGARI_ABBREVIATION_RE = re.compile('|'.join(
+    re.escape(abbr) for abbr in sorted(DEVANAGARI_ABBREVIATIONS, key=len, reverse=True)))
 
 def fix_devanagari_abbreviations(text):
     """Fix common Devanagari name abbreviations like के.सि → केसी"""
     if not isinstance(text, str):
         return text
-    text = text.replace('के.सि', 'केसी') \
-               .replace('कु.', 'कुमार') \
-               .replace('श.', 'शर्मा')  # Add more as needed
-    return text
+    return DEVANAGARI_ABBREVIATION_RE.sub(lambda m: DEVANAGARI_ABBREVIATIONS[m.group(0)], text)
 
 def romanize_name(name):
     if pd.isna(name):
         return ''
     name = fix_devanagari_abbreviations(name)
     try:
-        return transliterate(name, DEVANAGARI, ITRANS)
+        return transliterate(name, scheme_map=DEVANAGARI_TO_ITRANS)
     except:
         return str(name)
 
+# Below this many distinct names, worker start-up costs more than parallel romanization saves
+PARALLEL_ROMANIZE_MIN_NAMES = 20_000
+
+@lru_cache(maxsize=200_000)
+def romanize_and_clean(name):
+    return clean_name(romanize_name(name))
+
+def romanize_names(names):
+    return [romanize_and_clean(name) for name in names]
+
+def canonical_name(name):
+    """Sort name tokens once so plain fuzz.ratio scores like token_sort_ratio"""
+    return ' '.join(sorted(name.split()))
+
+# Bound each cdist call's score matrix to about this many cells (float32, so ~100 MB)
+CDIST_MAX_CELLS = 25_000_000
+
 def match_by_name(df_nrb, df_adbl, nrb_name_col, adbl_name_col, threshold=85):
-    df_nrb['romanized_name'] = df_nrb[nrb_name_col].apply(romanize_name).apply(clean_name)
+    # Blocklists repeat names a lot, so romanize each distinct name only once
+    unique_names = df_nrb[nrb_name_col].drop_duplicates()
+    names = unique_names.tolist()
+    if len(names) >= PARALLEL_ROMANIZE_MIN_NAMES:
+        chunks = Parallel(n_jobs=-1)(delayed(romanize_names)(names[i:i + 2048]) for i in range(0, len(names), 2048))
+        romanized_names = [name for chunk in chunks for name in chunk]
+    else:
+        romanized_names = romanize_names(names)
+    romanized = pd.Series(romanized_names, index=unique_names.values)
+    df_nrb['romanized_name'] = df_nrb[nrb_name_col].map(romanized).fillna('')
     df_adbl['romanized_name'] = df_adbl[adbl_name_col].astype(str).apply(clean_name)
 
-    matches = []
-    for _, row in df_nrb.iterrows():
-        name = row['romanized_name']
-        if not name:
-            continue
-        match, score, _ = process.extractOne(name, df_adbl['romanized_name'], scorer=fuzz.token_sort_ratio)
-        if score >= threshold:
-            matched_row = df_adbl[df_adbl['romanized_name'] == match].iloc[0]
-            # Drop romanized_name from matched_row to avoid duplicate columns
-            matched_row = matched_row.drop(labels=['romanized_name'])
-            # Concatenate with suffixes to ensure unique column names
-            merged_row = pd.concat([row, matched_row], axis=0, keys=['nrb', 'adbl']).reset_index(level=0, drop=True)
-            merged_row['match_score'] = score
-            matches.append(merged_row)
-
-    # Convert matches to DataFrame, ensuring unique columns
-    result = pd.DataFrame(matches)
-    if not result.empty:
-        # Rename columns to include source prefix (nrb_ or adbl_)
-        columns = result.columns
-        new_columns = []
-        for col in columns:
-            if col.startswith('nrb_'):
-                new_columns.append(col.replace('nrb_', 'nrb_'))
-            elif col.startswith('adbl_'):
-                new_columns.append(col.replace('adbl_', 'adbl_'))
-            else:
-                new_columns.append(col)
-        result.columns = new_columns
+    nrb_names = [canonical_name(n) for n in df_nrb['romanized_name']]
+    adbl_names = [canonical_name(n) for n in df_adbl['romanized_name']]
+    if not nrb_names or not adbl_names:
+        return pd.DataFrame()
+
+    # Names that romanize to an exact ADBL name need no fuzzy scoring
+    adbl_first_idx = {}
+    for i, name in enumerate(adbl_names):
+        adbl_first_idx.setdefault(name, i)
+    best_idx = np.zeros(len(nrb_names), dtype=np.intp)
+    best_score = np.zeros(len(nrb_names), dtype=np.float32)
+    fuzzy_rows = []
+    for i, name in enumerate(nrb_names):
+        if name in adbl_first_idx:
+            best_idx[i] = adbl_first_idx[name]
+            best_score[i] = 100
+        elif name:
+            fuzzy_rows.append(i)
+
+    # Score the rest against all ADBL names in row chunks; float32 keeps e.g. 84.6 from rounding up to 85
+    chunk_size = max(1, CDIST_MAX_CELLS // len(adbl_names))
+    for start in range(0, len(fuzzy_rows), chunk_size):
+        rows = fuzzy_rows[start:start + chunk_size]
+        # score_cutoff lets rapidfuzz stop early on dissimilar pairs; those score 0
+        scores = process.cdist([nrb_names[i] for i in rows], adbl_names, scorer=fuzz.ratio,
+                               score_cutoff=threshold, workers=-1, dtype=np.float32)
+        best_idx[rows] = scores.argmax(axis=1)
+        best_score[rows] = scores.max(axis=1)
+    mask = (best_score >= threshold) & (df_nrb['romanized_name'] != '').to_numpy()
+    nrb_idx = np.flatnonzero(mask)
+    adbl_idx = best_idx[nrb_idx]
+
+    # Gather both sides once; drop romanized_name from ADBL to avoid duplicate columns
+    matched_nrb = df_nrb.iloc[nrb_idx].reset_index(drop=True)
+    matched_adbl = df_adbl.iloc[adbl_idx].drop(columns=['romanized_name']).reset_index(drop=True)
+    result = matched_nrb.join(matched_adbl, lsuffix='_nrb', rsuffix='_adbl')
+    result['match_score'] = best_score[nrb_idx]
     return result
 
+@st.cache_data(show_spinner=False)
+def find_matches(excel_bytes, csv_bytes, nrb_cit_col, nrb_name_col, adbl_cit_col, adbl_name_col, threshold=85):
+    """Citizenship and name matches for one pair of uploads, cached on the file bytes, columns and threshold"""
+    # Load full rows so matches keep every column (e.g. account details) for follow-up
+    df_nrb = convert_numbers(read_nrb_excel(excel_bytes))
+    df_adbl = read_adbl_csv(csv_bytes)
+
+    # Clean selected columns
+    df_nrb = clean_column(df_nrb, nrb_cit_col)
+    df_adbl = clean_column(df_adbl, adbl_cit_col)
+    nrb_keys, adbl_keys = to_join_keys(df_nrb[nrb_cit_col], df_adbl[adbl_cit_col])
+
+    # Separate NRB into with and without citizenship number
+    df_nrb_citizenship = df_nrb.dropna(subset=[nrb_cit_col])
+    df_nrb_no_citizenship = df_nrb[df_nrb[nrb_cit_col].isna()]
+
+    # Step 1: Exact citizenship match, on temporary keys so the shown citizenship numbers stay as uploaded
+    merged_cit = pd.merge(
+        df_nrb_citizenship.assign(_cit_key=nrb_keys), df_adbl.assign(_cit_key=adbl_keys),
+        how='inner',
+        on='_cit_key',
+        suffixes=('_nrb', '_adbl')
+    ).drop(columns=['_cit_key'])
+    merged_cit['match_type'] = 'Citizenship Match'
+
+    # Step 2: Fuzzy name match for remaining NRB entries
+    fuzzy_matches = match_by_name(df_nrb_no_citizenship.copy(), df_adbl.copy(), nrb_name_col, adbl_name_col,
+                                  threshold)
+    if not fuzzy_matches.empty:
+        fuzzy_matches['match_type'] = 'Name Match'
+    return merged_cit, fuzzy_matches
+
 def main():
     st.set_page_config(page_title="NRB Block List Matcher", layout="centered")
     st.title("🔍 NRB–ADBL Blocklist Matcher App")
@@ -96,48 +239,34 @@ def main():
     excel_file = st.file_uploader("Upload NRB Excel (.xlsx)", type=["xlsx", "xls"])
 
     if excel_file:
-        df_nrb = pd.read_excel(excel_file)
-        df_nrb = convert_numbers(df_nrb)
+        # Peek at the first rows only; the full read waits until columns are chosen
+        excel_bytes = excel_file.getvalue()
+        nrb_preview = convert_numbers(read_nrb_excel(excel_bytes, nrows=5))
         st.success("✅ NRB Excel loaded!")
-        st.dataframe(df_nrb.head())
+        st.dataframe(nrb_preview)
 
         st.header("📥 Step 2: Upload ADBL Customer CSV")
         csv_file = st.file_uploader("Upload ADBL CSV (.csv)", type=["csv"])
 
         if csv_file:
-            df_adbl = pd.read_csv(csv_file, encoding='utf-8')
-            st.success("✅ ADBL CSV loaded!")
-            st.dataframe(df_adbl.head())
-
-            # Let user choose columns for matching
-            st.subheader("🔧 Select Columns for Matching")
-            nrb_cit_col = st.selectbox("NRB: Citizenship Number Column", df_nrb.columns)
-            nrb_name_col = st.selectbox("NRB: Name Column (Nepali)", df_nrb.columns)
-            adbl_cit_col = st.selectbox("ADBL: Citizenship Number Column", df_adbl.columns)
-            adbl_name_col = st.selectbox("ADBL: Name Column (English)", df_adbl.columns)
-
-            # Clean selected columns
-            df_nrb = clean_column(df_nrb, nrb_cit_col)
-            df_adbl = clean_column(df_adbl, adbl_cit_col)
-
-            # Separate NRB into with and without citizenship number
-            df_nrb_citizenship = df_nrb.dropna(subset=[nrb_cit_col])
-            df_nrb_no_citizenship = df_nrb[df_nrb[nrb_cit_col].isna()]
-
-            # Step 1: Exact citizenship match
-            merged_cit = pd.merge(
-                df_nrb_citizenship, df_adbl,
-                how='inner',
-                left_on=nrb_cit_col,
-                right_on=adbl_cit_col,
-                suffixes=('_nrb', '_adbl')
-            )
-            merged_cit['match_type'] = 'Citizenship Match'
-
-            # Step 2: Fuzzy name match for remaining NRB entries
-            fuzzy_matches = match_by_name(df_nrb_no_citizenship.copy(), df_adbl.copy(), nrb_name_col, adbl_name_col)
-            if not fuzzy_matches.empty:
-                fuzzy_matches['match_type'] = 'Name Match'
+            csv_bytes = csv_file.getvalue()
+            try:
+                adbl_preview = read_adbl_csv(csv_bytes, preview=True)
+                st.success("✅ ADBL CSV loaded!")
+                st.dataframe(adbl_preview)
+
+                # Let user choose columns for matching
+                st.subheader("🔧 Select Columns for Matching")
+                nrb_cit_col = st.selectbox("NRB: Citizenship Number Column", nrb_preview.columns)
+                nrb_name_col = st.selectbox("NRB: Name Column (Nepali)", nrb_preview.columns)
+                adbl_cit_col = st.selectbox("ADBL: Citizenship Number Column", adbl_preview.columns)
+                adbl_name_col = st.selectbox("ADBL: Name Column (English)", adbl_preview.columns)
+
+                merged_cit, fuzzy_matches = find_matches(excel_bytes, csv_bytes, nrb_cit_col, nrb_name_col,
+                                                         adbl_cit_col, adbl_name_col)
+            except UnicodeDecodeError:
+                st.error("❗ CSV is not UTF-8 encoded. Please re-save the file with UTF-8 encoding.")
+                return
 
             # Display results
             st.subheader(f"🎯 Total Matches Found: {len(merged_cit) + len(fuzzy_matches)}")
@@ -146,9 +275,10 @@ def main():
             st.markdown("### 🔐 Table 1: Citizenship Matches")
             if not merged_cit.empty:
                 st.dataframe(merged_cit)
+                # Pass a callable so the workbook is only built when the button is clicked
                 st.download_button(
                     "⬇️ Download Citizenship Matches (Excel)",
-                    to_excel(merged_cit),
+                    lambda: to_excel(merged_cit),
                     file_name="nrb_adbl_citizenship_matches.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
@@ -161,7 +291,7 @@ def main():
                 st.dataframe(fuzzy_matches)
                 st.download_button(
                     "⬇️ Download Name Matches (Excel)",
-                    to_excel(fuzzy_matches),
+                    lambda: to_excel(fuzzy_matches),
                     file_name="nrb_adbl_name_matches.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
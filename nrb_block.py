@@ -1,35 +1,92 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from io import BytesIO
+from collections import defaultdict
 from PIL import Image
 
-# Mapping for Nepali Devanagari numbers to English numbers
-nepali_to_english_numbers = {
+# Translation table for Nepali Devanagari numbers to English numbers
+nepali_to_english_numbers = str.maketrans({
     '०': '0', '१': '1', '२': '2', '३': '3', '४': '4',
     '५': '5', '६': '6', '७': '7', '८': '8', '९': '9'
-}
+})
 
 def convert_nepali_number_to_english(text):
     """Convert Nepali Devanagari numbers to English."""
     if not isinstance(text, str):
         return text
-    return ''.join(nepali_to_english_numbers.get(char, char) for char in text)
+    return text.translate(nepali_to_english_numbers)
 
 def convert_numbers(df):
     """Apply Nepali to English conversion across DataFrame."""
-    return df.apply(lambda x: x.map(convert_nepali_number_to_english) if x.dtype == "object" else x)
+    text = df.select_dtypes(include=['object', 'string'])
+    df[text.columns] = text.apply(convert_number_column)
+    return df
+
+def convert_number_column(values):
+    """Convert one text column, cell by cell unless it holds only strings."""
+    # .str only works on text columns; bools, dates or mixed values go cell by cell
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        return values.str.translate(nepali_to_english_numbers)
+    return values.map(convert_nepali_number_to_english)
 
 def clean_column(df, column):
     """Strip whitespace and replace empty values with None."""
     if column in df.columns:
-        df[column] = df[column].astype(str).str.strip()
-        df[column] = df[column].replace(['nan', '', ' '], None)
+        values = df[column].astype('string[pyarrow]').str.strip()
+        df[column] = values.mask(values == '')
     return df
 
+def to_join_keys(left, right):
+    """Encode cleaned citizenship columns as int64 or shared categorical join keys."""
+    # Drop leading zeros from all-digit IDs first so "0678" matches "678" whichever path is taken
+    left = left.str.replace(r'^0+(?=\d+$)', '', regex=True)
+    right = right.str.replace(r'^0+(?=\d+$)', '', regex=True)
+    if left.str.fullmatch(r'\d{1,18}').all() and right.str.fullmatch(r'\d{1,18}').all():
+        return pd.to_numeric(left).astype('Int64'), pd.to_numeric(right).astype('Int64')
+    # Non-numeric IDs like "12-34": join on integer codes of one shared category set
+    keys = pd.CategoricalDtype(pd.Index(left.dropna().unique()).union(right.dropna().unique()))
+    return left.astype(keys), right.astype(keys)
+
+@st.cache_data(show_spinner=False)
+def load_excel(data):
+    """Read uploaded Excel bytes, cached so reruns skip parsing."""
+    return pd.read_excel(BytesIO(data))
+
+def unique_headers(names):
+    """Name blank and repeated headers like pandas does ("Unnamed: 2", "A.1")."""
+    seen = defaultdict(int)
+    columns = []
+    for i, col in enumerate(names):
+        col = col or f'Unnamed: {i}'
+        columns.append(f'{col}.{seen[col]}' if seen[col] else col)
+        seen[col] += 1
+    return columns
+
+@st.cache_data(show_spinner=False)
+def load_csv(data):
+    """Read uploaded CSV bytes with pyarrow, cached so reruns skip parsing."""
+    table = pacsv.read_csv(BytesIO(data), read_options=pacsv.ReadOptions(encoding='utf8'))
+    # pyarrow falls back to binary columns instead of failing on non-UTF-8 text
+    if any(pa.types.is_binary(field.type) for field in table.schema):
+        raise UnicodeDecodeError('utf-8', data, 0, len(data), 'invalid UTF-8 data in CSV')
+    return table.rename_columns(unique_headers(table.column_names)).to_pandas(types_mapper=pd.ArrowDtype)
+
+@st.cache_data(show_spinner=False)
+def load_converted_excel(data):
+    """Read and convert uploaded Excel bytes, cached on the bytes."""
+    return convert_numbers(load_excel(data))
+
+@st.cache_data(show_spinner=False)
+def match_uploads(excel_data, csv_data):
+    """Merge the uploaded NRB Excel and ADBL CSV, cached on both files' bytes."""
+    return merge_csvs_by_columns(load_converted_excel(excel_data), load_csv(csv_data))
+
 def to_excel(df):
     """Convert DataFrame to Excel bytes."""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         df.to_excel(writer, index=False)
     return output.getvalue()
 
@@ -45,18 +102,19 @@ def merge_csvs_by_columns(df1, df2):
     
     df1 = clean_column(df1, required_col1)
     df2 = clean_column(df2, required_col2)
+    keys1, keys2 = to_join_keys(df1[required_col1], df2[required_col2])
     
     original_len = len(df1)
     df1 = df1.dropna(subset=[required_col1])
     st.info(f"Filtered out {original_len - len(df1)} rows with empty citizenship numbers.")
 
+    # Join on temporary keys so the citizenship numbers shown and downloaded stay as uploaded
     merged_df = pd.merge(
-        df1,
-        df2,
+        df1.assign(_cit_key=keys1),
+        df2.assign(_cit_key=keys2),
         how='inner',
-        left_on=required_col1,
-        right_on=required_col2
-    )
+        on='_cit_key'
+    ).drop(columns=['_cit_key'])
     return merged_df
 
 def main():
@@ -78,24 +136,26 @@ def main():
 
     if excel_file:
         try:
-            df_nrb = pd.read_excel(excel_file)
+            excel_bytes = excel_file.getvalue()
+            df_nrb = load_excel(excel_bytes)
             st.success("✅ Excel file loaded successfully!")
 
             st.subheader("👀 Preview of Original Data")
             st.dataframe(df_nrb.head(10))
 
-            df_nrb_converted = convert_numbers(df_nrb)
+            df_nrb_converted = load_converted_excel(excel_bytes)
             st.subheader("🔄 Converted Data (Devanagari → English Numbers)")
             st.dataframe(df_nrb_converted.head(10))
 
             # Download buttons for converted file
             st.subheader("⬇️ Download Converted File")
+            # Download data is passed as callables so files are only built when clicked
             col1, col2 = st.columns(2)
             with col1:
-                st.download_button("Download CSV", df_nrb_converted.to_csv(index=False, encoding="utf-8-sig"),
+                st.download_button("Download CSV", lambda: df_nrb_converted.to_csv(index=False, encoding="utf-8-sig"),
                                    "converted_output.csv", "text/csv")
             with col2:
-                st.download_button("Download Excel", to_excel(df_nrb_converted),
+                st.download_button("Download Excel", lambda: to_excel(df_nrb_converted),
                                    "converted_output.xlsx",
                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
@@ -105,11 +165,10 @@ def main():
 
             if csv_file:
                 try:
-                    df_adbl = pd.read_csv(csv_file, encoding='utf-8')
+                    # match_uploads parses the CSV and raises UnicodeDecodeError on bad encodings
+                    merged_df = match_uploads(excel_bytes, csv_file.getvalue())
                     st.success("✅ CSV file loaded successfully!")
 
-                    merged_df = merge_csvs_by_columns(df_nrb_converted, df_adbl)
-
                     st.subheader("🔍 Matched Records: Blacklisted Customers in ADBL")
                     if not merged_df.empty:
                         st.dataframe(merged_df)
@@ -118,11 +177,11 @@ def main():
                         col3, col4 = st.columns(2)
                         with col3:
                             st.download_button("Download Matched CSV",
-                                               merged_df.to_csv(index=False, encoding="utf-8-sig"),
+                                               lambda: merged_df.to_csv(index=False, encoding="utf-8-sig"),
                                                "matched_output.csv", "text/csv")
                         with col4:
                             st.download_button("Download Matched Excel",
-                                               to_excel(merged_df),
+                                               lambda: to_excel(merged_df),
                                                "matched_output.xlsx",
                                                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
                     else: